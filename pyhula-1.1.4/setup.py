@@ -2,31 +2,48 @@
 python setup.py build
 '''
 
-import Cython.Build
-import distutils.core
 import os
-import struct
-from setuptools import setup, find_packages
-def get_data_files(file_dir):
-	data_files_dir = {}
-	for root, dirs, files in os.walk(file_dir):  
-		#print(root) #当前目录路径  
-		#print(dirs) #当前路径下所有子目录  
-		#print(files) #当前路径下所有非目录子文件
-		if root not in data_files_dir:
-			data_files_dir[root] = []
-			
-		for f in files:
-			if f == '.gitignore':
-				continue
-			data_files_dir[root].append(root[2:]+'\\'+f)
-	
-	#print(data_files_dir)
-	data_files = []
-	for path in data_files_dir:
-		data_files.append(('Lib\\site-packages\\pyhula\\'+path[13:], data_files_dir[path]))
-	#data_files_set = [root]
-	return data_files
+import shutil
+import sysconfig
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
+
+# 系统装有ccache时用其包装C编译器, 未改动的编译单元直接命中缓存; 设置 PYHULA_NO_CCACHE=1 可关闭
+if os.name != 'nt' and 'CC' not in os.environ and os.environ.get('PYHULA_NO_CCACHE') != '1':
+	ccache = shutil.which('ccache')
+	cc = sysconfig.get_config_var('CC')
+	if ccache and cc:
+		os.environ['CC'] = ccache + ' ' + cc
+		os.environ.setdefault('CCACHE_COMPILERCHECK', 'content')
+
+# 各编译器的优化参数(MSVC的默认参数已包含 /O2 和 /OPT:REF,ICF, 无需追加); 设置 PYHULA_NATIVE=1 时GCC/Clang针对本机CPU指令集优化(生成的扩展不可移植到其他机器)
+EXTRA_COMPILE_ARGS = {
+	'unix': ('-O3',),
+}
+NATIVE_COMPILE_ARGS = {
+	'unix': ('-march=native',),
+}
+
+class BuildExt(build_ext):
+	'''
+	未指定 -j/--parallel 时, 按CPU核数并行编译C扩展, 并按编译器类型追加优化参数
+	'''
+	def finalize_options(self):
+		super().finalize_options()
+		if self.parallel is None:
+			self.parallel = os.cpu_count()
+
+	def build_extensions(self):
+		# 并行编译时各线程会同时惰性初始化MSVC(每次都运行vcvarsall.bat, 且可能触发重复初始化断言), 先在主线程初始化一次
+		if self.compiler.compiler_type == 'msvc' and not self.compiler.initialized:
+			self.compiler.initialize(self.plat_name)
+		compiler_type = 'msvc' if self.compiler.compiler_type == 'msvc' else 'unix'
+		compile_args = list(EXTRA_COMPILE_ARGS.get(compiler_type, ()))
+		if os.environ.get('PYHULA_NATIVE') == '1':
+			compile_args += NATIVE_COMPILE_ARGS.get(compiler_type, ())
+		for ext in self.extensions:
+			ext.extra_compile_args = compile_args + ext.extra_compile_args
+		super().build_extensions()
 
 name = 'pyhula'
 version = '1.1.4'
@@ -34,52 +51,74 @@ description = "Hula package"
 author = 'HighGreat'
 author_email = 'highgreat@hg-fly.com'
 
-commandprocessor = Cython.Build.cythonize('./src/pyhula/pypack/fylo/commandprocessor.py')[0]
-config = Cython.Build.cythonize('./src/pyhula/pypack/fylo/config.py')[0]
-controlserver = Cython.Build.cythonize('./src/pyhula/pypack/fylo/controlserver.py')[0]
-mavlink = Cython.Build.cythonize('./src/pyhula/pypack/fylo/mavlink.py')[0]
-msganalyzer = Cython.Build.cythonize('./src/pyhula/pypack/fylo/msganalyzer.py')[0]
-mavanalyzer = Cython.Build.cythonize('./src/pyhula/pypack/fylo/mavanalyzer.py')[0]
-stateprocessor = Cython.Build.cythonize('./src/pyhula/pypack/fylo/stateprocessor.py')[0]
-taskprocessor = Cython.Build.cythonize('./src/pyhula/pypack/fylo/taskprocessor.py')[0]
-uwb = Cython.Build.cythonize('./src/pyhula/pypack/fylo/uwb.py')[0]
-
-buffer = Cython.Build.cythonize('./src/pyhula/pypack/system/buffer.py')[0]
-command = Cython.Build.cythonize('./src/pyhula/pypack/system/command.py')[0]
-communicationcontroller = Cython.Build.cythonize('./src/pyhula/pypack/system/communicationcontroller.py')[0]
-communicationcontrollerfactory = Cython.Build.cythonize('./src/pyhula/pypack/system/communicationcontrollerfactory.py')[0]
-dancecontroller = Cython.Build.cythonize('./src/pyhula/pypack/system/dancecontroller.py')[0]
-dancefileanalyzer = Cython.Build.cythonize('./src/pyhula/pypack/system/dancefileanalyzer.py')[0]
-
-datacenter = Cython.Build.cythonize('./src/pyhula/pypack/system/datacenter.py')[0]
-event = Cython.Build.cythonize('./src/pyhula/pypack/system/event.py')[0]
-mavcrc = Cython.Build.cythonize('./src/pyhula/pypack/system/mavcrc.py')[0]
-network = Cython.Build.cythonize('./src/pyhula/pypack/system/network.py')[0]
-networkcontroller = Cython.Build.cythonize('./src/pyhula/pypack/system/networkcontroller.py')[0]
-serialcontroller = Cython.Build.cythonize('./src/pyhula/pypack/system/serialcontroller.py')[0]
-state = Cython.Build.cythonize('./src/pyhula/pypack/system/state.py')[0]
-system = Cython.Build.cythonize('./src/pyhula/pypack/system/system.py')[0]
-taskcontroller = Cython.Build.cythonize('./src/pyhula/pypack/system/taskcontroller.py')[0]
-
-
-
-# action_funtion = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/action_funtion.py')[0]
-# getBoundry = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/getBoundry.py')[0]
-# output_pos = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/output_pos.py')[0]
-# parsejson = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/parsejson.py')[0]
-# print_struct = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/print_struct.py')[0]
-# op_seq_judgment = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/op_seq_judgment.py')[0]
-# judgeBoundary = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/judgeBoundary.py')[0]
-# matxtreader = Cython.Build.cythonize('./src/pyhula/pypack/system/dance/matxtreader.py')[0]
-
-
-
-ext_modules = [commandprocessor, config, controlserver, mavlink, msganalyzer, mavanalyzer,	stateprocessor, taskprocessor, 
-uwb, buffer, command, communicationcontroller, communicationcontrollerfactory, dancecontroller, dancefileanalyzer, 
- datacenter, event, mavcrc, network, networkcontroller, serialcontroller, state, system, taskcontroller, 
- ]
-# action_funtion, getBoundry, output_pos, parsejson, print_struct, op_seq_judgment, judgeBoundary, 
-# matxtreader
+ext_names = [
+'pyhula.pypack.fylo.commandprocessor',
+'pyhula.pypack.fylo.config',
+'pyhula.pypack.fylo.controlserver',
+'pyhula.pypack.fylo.mavlink',
+'pyhula.pypack.fylo.msganalyzer',
+'pyhula.pypack.fylo.mavanalyzer',
+'pyhula.pypack.fylo.stateprocessor',
+'pyhula.pypack.fylo.taskprocessor',
+'pyhula.pypack.fylo.uwb',
+
+'pyhula.pypack.system.buffer',
+'pyhula.pypack.system.command',
+'pyhula.pypack.system.communicationcontroller',
+'pyhula.pypack.system.communicationcontrollerfactory',
+'pyhula.pypack.system.dancecontroller',
+'pyhula.pypack.system.dancefileanalyzer',
+'pyhula.pypack.system.datacenter',
+'pyhula.pypack.system.event',
+'pyhula.pypack.system.mavcrc',
+'pyhula.pypack.system.network',
+'pyhula.pypack.system.networkcontroller',
+'pyhula.pypack.system.serialcontroller',
+'pyhula.pypack.system.state',
+'pyhula.pypack.system.system',
+'pyhula.pypack.system.taskcontroller',
+]
+# 'pyhula.pypack.system.dance.action_funtion', 'pyhula.pypack.system.dance.getBoundry',
+# 'pyhula.pypack.system.dance.output_pos', 'pyhula.pypack.system.dance.parsejson',
+# 'pyhula.pypack.system.dance.print_struct', 'pyhula.pypack.system.dance.op_seq_judgment',
+# 'pyhula.pypack.system.dance.judgeBoundary', 'pyhula.pypack.system.dance.matxtreader',
+
+def get_ext_modules():
+	'''
+	有 .py 源码且装有Cython时一次性cythonize全部模块(并行, 带缓存), 否则直接编译随包发布的 .c 文件
+	'''
+	# 一次遍历收集已有的 .py 源码, 代替逐个模块 stat
+	py_sources = set()
+	for root, dirs, files in os.walk('./src/pyhula/pypack'):
+		root = root.replace('\\', '/')
+		py_sources.update(root + '/' + f for f in files if f.endswith('.py'))
+	# Cython导入开销较大, 只在确有 .py 源码时才导入
+	if py_sources:
+		try:
+			from Cython.Build import cythonize
+		except ImportError:
+			py_sources = set()
+
+	extensions = []
+	use_cython = False
+	for ext_name in ext_names:
+		source = './src/' + ext_name.replace('.', '/')
+		if source + '.py' in py_sources:
+			source += '.py'
+			use_cython = True
+		else:
+			source += '.c'
+		extensions.append(Extension(ext_name, [source], language = 'c'))
+
+	if not use_cython:
+		return extensions
+	# spawn/forkserver 启动的子进程会重新执行本文件(无 __main__ 保护), 只在 fork 模式下并行
+	import multiprocessing
+	nthreads = os.cpu_count() if multiprocessing.get_start_method() == 'fork' else 0
+	return cythonize(extensions, nthreads = nthreads, cache = True)
+
+ext_modules = get_ext_modules()
+
 
 mat_data = [('Lib/site-packages/pyhula/pypack/system/dance', [
 'src/pyhula/pypack/system/dance/arrow-anticlockwise.matxt',
@@ -120,10 +159,6 @@ dancefile_data = [('Lib/site-packages/pyhula/pypack/dancefile', [])]
 
 ini_data = [('Lib/site-packages/pyhula/pypack', ['src/pyhula/pypack/log.ini', 'src/pyhula/pypack/version.ini'])]
 
-# if struct.calcsize('P') == 4:   
-#     danceviewsoftware = get_data_files('.\src\pyhula\FyloPlayer32')
-# else:
-#     danceviewsoftware = get_data_files('.\src\pyhula\FyloPlayer')
 danceviewsoftware = [('Lib/site-packages/pyhula', ['src/pyhula/f09-lite-trans/f09-ffmpeg-lib.dll'])]
 classifiers = [
 "Intended Audience :: Education",
@@ -143,17 +178,20 @@ classifiers = [
 
 with open("requirements.txt") as f:
     requirements = f.read().splitlines()
-distutils.core.setup(
+with open('./readmewhl.md', encoding='utf-8') as f:
+    long_description = f.read()
+setup(
 name = name,
 version = version,
 description = description,
-long_description = open('./readmewhl.md', encoding='utf-8').read(),
+long_description = long_description,
 long_description_content_type = 'text/markdown',
 author = author,
 author_email = author_email,
 packages = ['pyhula'],
 package_dir = {'pyhula':'src/pyhula'},
 ext_modules = ext_modules,
+cmdclass = {'build_ext': BuildExt},
 # data_files = danceviewsoftware + dancefile_data + ini_data + mat_data,
 data_files = ini_data ,
 install_requires = requirements,
@@ -1,8 +1,10 @@
+import functools
 import os
 from .userapi import *
 
+@functools.lru_cache(maxsize=1)
 def get_version():
-	version_path = os.path.dirname(os.path.realpath(__file__)) + '\\pypack\\version.ini'
+	version_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pypack', 'version.ini')
 
 	with open(version_path, 'rb') as f:
 		version = f.read()
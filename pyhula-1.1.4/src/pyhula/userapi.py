@@ -6,20 +6,28 @@ from .pypack.fylo.controlserver import Controlserver, ConnectType
 
 
 import os
- 
+import sys
+
 # 获取当前文件的绝对路径
 current_file_path = os.path.abspath(__file__)
 
 path_text= os.path.dirname(current_file_path)
-new_path = os.path.join(path_text, 'f09-lite-trans;')
-# # 获取当前的PATH环境变量
-current_path = os.environ.get('PATH', '')
-
-# # 将新的文件夹路径添加到PATH中
-new_path_s = f"{new_path}:{current_path}"
-
-# # 更新环境变量
-os.environ['PATH'] = new_path_s
+new_path = os.path.join(path_text, 'f09-lite-trans')
+
+if sys.platform == 'win32' and hasattr(os, 'add_dll_directory'):
+	# Python 3.8+ 在Windows上不再通过PATH查找DLL, 直接注册DLL目录(目录不存在时抛出OSError)
+	try:
+		os.add_dll_directory(new_path)
+	except OSError:
+		pass
+elif sys.platform == 'win32':
+	# Python 3.8以下的Windows仍通过PATH查找DLL
+	# # 获取当前的PATH环境变量
+	current_path = os.environ.get('PATH', '')
+
+	# # 将新的文件夹路径添加到PATH中(仅添加一次)
+	if new_path not in current_path.split(os.pathsep):
+		os.environ['PATH'] = new_path + os.pathsep + current_path
 class UserApi:
 	def __init__(self):
 		self._control_server = Controlserver()